@@ -1,15 +1,22 @@
-from fastapi import FastAPI, Request, HTTPException, UploadFile, Depends
+from fastapi import FastAPI, Request, HTTPException, UploadFile, Depends, BackgroundTasks
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, PlainTextResponse, FileResponse, StreamingResponse
 import psutil
 from pydantic import BaseModel
 import re
 import os
+import functools
 import subprocess
 from typing import List
 import logging
-import shutil
+import aiofiles
 import json
+import orjson
+
+from azure.mgmt.appcontainers import ContainerAppsAPIClient
+from azure.mgmt.appcontainers.models import JobExecutionBase, JobExecutionTemplate
+from azure.core.polling import LROPoller
+from azure.identity import DefaultAzureCredential
 
 from dotenv import load_dotenv
 load_dotenv(override=True)
@@ -23,14 +30,20 @@ from doc_utils import search, generate_section, write_to_file
 from processor import read_asset_file, gpt4_models
 from utils.cogsearch_rest import CogSearchHttpRequest, CogSearchRestAPI
 from aml_job import AmlJob
-from env_vars import ROOT_PATH_INGESTION
+from env_vars import ROOT_PATH_INGESTION, PROMPTS_PATH, INGESTION_JOB_NAME, LOCAL_TESTING, \
+    AML_RESOURCE_GROUP, AML_SUBSCRIPTION_ID, AML_WORKSPACE_NAME, \
+    SEARCH_WORKERS, SEARCH_MAX_CONCURRENCY, COSMOS_CACHE_TTL, INDEX_UPDATE_DEBOUNCE, \
+    COG_SEARCH_INDEX_CACHE_TTL, COG_SEARCH_MISSING_INDEX_CACHE_TTL, FILE_EXISTS_CACHE_TTL, \
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_SIMILARITY, SEARCH_SEMANTIC_CACHE
 from utils.ingestion_cosmos_helper import IngestionCosmosHelper
-import threading
+from utils.search_cache import SearchResultCache
     
 # Ensure all doc_utils.logc calls are redirected to the append_log_message function
 import utils.logc
 import asyncio
-import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 
 # Global setup
 LOG_CONTAINER_NAME = os.environ.get("COSMOS_LOG_CONTAINER")
@@ -42,21 +55,108 @@ cosmos_log = cs.SCCosmosClient(container_name=LOG_CONTAINER_NAME)
 ic = IngestionCosmosHelper()
 file_pattern = re.compile(r'system_prompt_ver_(\d+)\.txt')
 
-
-def get_latest_file_version(directory, file_pattern):
+# The available job runners only depend on the environment, so they are computed once
+JOB_RUNNERS = [name for enabled, name in [
+    (AML_RESOURCE_GROUP and AML_SUBSCRIPTION_ID and AML_WORKSPACE_NAME, "Azure Machine Learning"),
+    (INGESTION_JOB_NAME, "Container App Job"),
+    (LOCAL_TESTING, "Subprocess (Local Testing)"),
+] if enabled]
+
+# Short lived cache for the Cosmos reads polled by the UI, concurrent misses share a single read
+# Entries are dropped by the routes that write the underlying documents
+cosmos_cache = TTLCache(maxsize=128, ttl=COSMOS_CACHE_TTL)
+
+async def cached_cosmos_read(key, func, *args):
+    read = cosmos_cache.get(key)
+    if read is None:
+        read = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        cosmos_cache[key] = read
+    try:
+        # Shielded so a cancelled request does not cancel the read for the other waiters
+        return await asyncio.shield(read)
+    except Exception:
+        # Do not keep serving a failed read until it expires
+        if cosmos_cache.get(key) is read:
+            cosmos_cache.pop(key, None)
+        raise
+
+def invalidate_prompts_cache():
+    cosmos_cache.pop("prompts", None)
+
+def invalidate_index_cache(index_name):
+    cosmos_cache.pop(("status", index_name), None)
+    cosmos_cache.pop(("log", index_name), None)
+
+# Search results cache, exact match on the request parameters then, if enabled, semantic match on the query
+# The key includes the version of the index document, so every worker stops serving results once the index changes
+# Entries of an index are also dropped right away by the worker that receives its ingestion job status update
+search_cache = SearchResultCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, similarity_threshold=SEARCH_CACHE_SIMILARITY, semantic=SEARCH_SEMANTIC_CACHE)
+
+# Bounded worker pool for /search-stream, searches beyond the semaphore limit wait for a free slot
+SEARCH_POOL = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+SEARCH_SEMAPHORE = asyncio.Semaphore(SEARCH_MAX_CONCURRENCY)
+
+
+# The directory mtime is part of the cache key, so adding or removing a prompt version invalidates the entry
+@functools.lru_cache(maxsize=256)
+def _latest_file(directory, mtime_ns, file_pattern):
     max_version = -1
     latest_file = None
 
-    for filename in os.listdir(directory):
-        match = file_pattern.match(filename)
-        if match:
-            version = int(match.group(1))
-            if version > max_version:
-                max_version = version
-                latest_file = filename
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            # fullmatch so that e.g. system_prompt_ver_1.txt.bak is not picked up
+            match = file_pattern.fullmatch(entry.name)
+            if match:
+                version = int(match.group(1))
+                if version > max_version:
+                    max_version = version
+                    latest_file = entry.name
 
     return os.path.join(directory, latest_file) if latest_file else None
 
+def get_latest_file_version(directory, file_pattern):
+    return _latest_file(directory, os.stat(directory).st_mtime_ns, file_pattern)
+
+# Same invalidation scheme for file contents, keyed on the file mtime
+@functools.lru_cache(maxsize=512)
+def _read_asset_file_cached(asset_path, mtime_ns):
+    text, status = read_asset_file(asset_path)
+    if not status:
+        # lru_cache does not store calls that raise, so a failed read is retried on the next request
+        raise OSError(f"Could not read {asset_path}")
+    return text
+
+def read_asset_file_cached(asset_path):
+    try:
+        mtime_ns = os.stat(asset_path).st_mtime_ns
+    except (OSError, TypeError):
+        # Missing file, let read_asset_file handle it without caching the failure
+        return read_asset_file(asset_path)[0]
+    try:
+        return _read_asset_file_cached(asset_path, mtime_ns)
+    except OSError:
+        # The file exists but could not be read (I/O error, file being rewritten), same empty text as read_asset_file
+        return ""
+
+def resolve_asset_path(asset_path):
+    # If asset path begins with ../, replace it with the root path
+    if asset_path.startswith("../"):
+        asset_path = asset_path.replace("../", f"{ROOT_PATH_INGESTION}/")
+    return asset_path
+
+# The UI checks the same reference files repeatedly while rendering search results
+file_exists_cache = TTLCache(maxsize=4096, ttl=FILE_EXISTS_CACHE_TTL)
+
+async def asset_path_exists(asset_path):
+    exists = file_exists_cache.get(asset_path)
+    if exists is None:
+        exists = await asyncio.to_thread(os.path.exists, asset_path)
+        file_exists_cache[asset_path] = exists
+    return exists
+
 # FastAPI global configuration
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
@@ -70,27 +170,20 @@ async def validation_exception_handler(request, exc):
 
 # A GET operation to get job runners
 @app.get("/job_runners")
-def get_job_runners():
+async def get_job_runners():
     try:
-        logging.info("Getting job runners")
-        list = []
-        if os.environ.get("AML_RESOURCE_GROUP") and os.environ.get("AML_SUBSCRIPTION_ID") and os.environ.get("AML_WORKSPACE_NAME"):
-            list.append("Azure Machine Learning")
-        if os.environ.get("INGESTION_JOB_NAME"):
-            list.append("Container App Job")
-        if os.environ.get("LOCAL_TESTING"):
-            list.append("Subprocess (Local Testing)")
-        return list
+        logging.debug("Getting job runners")
+        return JOB_RUNNERS
     except Exception as e:
         logging.error(f"Error getting job runners: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # A GET operation to get all prompts
 @app.get("/prompt")
-def get_prompts():
+async def get_prompts():
     try:
-        logging.info("Getting all prompts")
-        return cosmos.get_all_documents()
+        logging.debug("Getting all prompts")
+        return await cached_cosmos_read("prompts", cosmos.get_all_documents)
     except Exception as e:
         logging.error(f"Error getting prompts: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -101,7 +194,9 @@ async def upsert_prompt(prompt: Request):
     try:
         logging.info("Upserting a prompt")
         doc = await prompt.json()
-        return cosmos.upsert_document(doc)
+        result = await asyncio.to_thread(cosmos.upsert_document, doc)
+        invalidate_prompts_cache()
+        return result
     except Exception as e:
         logging.error(f"Error upserting prompt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -112,35 +207,39 @@ async def create_prompt(prompt: Request):
     try:
         logging.info("Creating a new prompt")
         doc = await prompt.json()
-        return cosmos.create_document(doc)
+        result = await asyncio.to_thread(cosmos.create_document, doc)
+        invalidate_prompts_cache()
+        return result
     except Exception as e:
         logging.error(f"Error creating prompt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # A DELETE operation to delete a prompt
 @app.delete("/prompt/{prompt_id}")
-def delete_prompt(prompt_id):
+async def delete_prompt(prompt_id):
     try:
         logging.info("Deleting a prompt")
-        return cosmos.delete_document(prompt_id)
+        result = await asyncio.to_thread(cosmos.delete_document, prompt_id)
+        invalidate_prompts_cache()
+        return result
     except Exception as e:
         logging.error(f"Error deleting prompt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # A GET operation to get a specific prompt
 @app.get("/prompt/{prompt_id}", response_class=PlainTextResponse)
-def get_prompt(prompt_id: str):
+async def get_prompt(prompt_id: str):
     try:
-        logging.info(f"Getting prompt with ID: {prompt_id}")
-        prompts_path = os.environ.get("PROMPTS_PATH")
+        logging.debug("Getting prompt with ID: %s", prompt_id)
+        prompts_path = PROMPTS_PATH
         if not prompts_path:
             #if it is empty it means the user does not have the environment variable set, 
             #so we assume its a local developer and will not populate paths from file share
             prompts_path = "../code/prompts"
 
         prompt_dir = os.path.join(prompts_path, prompt_id)
-        prompt_file = get_latest_file_version(prompt_dir, file_pattern)
-        prompt = read_asset_file(prompt_file)[0]
+        prompt_file = await asyncio.to_thread(get_latest_file_version, prompt_dir, file_pattern)
+        prompt = await asyncio.to_thread(read_asset_file_cached, prompt_file)
         return prompt
     except Exception as e:
         logging.error(f"Error getting prompt: {str(e)}")
@@ -150,7 +249,7 @@ def get_prompt(prompt_id: str):
 @app.get("/models")
 def get_models():
     try:
-        logging.info("Getting all models")
+        logging.debug("Getting all models")
         return gpt4_models
     except Exception as e:
         logging.error(f"Error getting models: {str(e)}")
@@ -158,12 +257,10 @@ def get_models():
 
 # A GET operation to get a file
 @app.get("/file")
-def get_file(asset_path: str, format:str = "text"):
+async def get_file(asset_path: str, format:str = "text"):
     try:
-        # If asset path begins with ../, replace it with the root path
-        if asset_path.startswith("../"):
-            asset_path = asset_path.replace("../", f"{ROOT_PATH_INGESTION}/")
-        logging.info(f"Getting file: {asset_path}")
+        asset_path = resolve_asset_path(asset_path)
+        logging.debug("Getting file: %s", asset_path)
         
         if format == "binary":
             return FileResponse(
@@ -171,25 +268,42 @@ def get_file(asset_path: str, format:str = "text"):
                 # required to ensure the file is displayed in the browser correctly
                 content_disposition_type="inline")
         elif format == "text":
-            text, status = read_asset_file(asset_path)
-            return text
+            # Sent straight from disk instead of being read into memory and JSON encoded
+            text_path = asset_path.replace("\\", "/")
+            if not await asyncio.to_thread(os.path.isfile, text_path):
+                # Same as read_asset_file, a missing file is returned as empty text
+                logging.warning(f"File not found: {text_path}")
+                return PlainTextResponse("")
+            return FileResponse(text_path, media_type="text/plain; charset=utf-8")
     except Exception as e:
         logging.error(f"Error getting file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Check if the file exists
 @app.get("/file_exists")
-def check_file_exists(asset_path: str):
+async def check_file_exists(asset_path: str):
     try:
-        # If asset path begins with ../, replace it with the root path
-        if asset_path.startswith("../"):
-            asset_path = asset_path.replace("../", f"{ROOT_PATH_INGESTION}/")
-        logging.info(f"Checking if file exists: {asset_path}")
-        return os.path.exists(asset_path)
+        asset_path = resolve_asset_path(asset_path)
+        logging.debug("Checking if file exists: %s", asset_path)
+        return await asset_path_exists(asset_path)
     except Exception as e:
         logging.error(f"Error checking if file exists: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class FilesExistRequest(BaseModel):
+    paths: List[str]
+
+# Check if several files exist in one call, returns a mapping of each requested path to a boolean
+@app.post("/files_exist")
+async def check_files_exist(request: FilesExistRequest):
+    try:
+        logging.debug("Checking if %d files exist", len(request.paths))
+        results = await asyncio.gather(*(asset_path_exists(resolve_asset_path(p)) for p in request.paths))
+        return dict(zip(request.paths, results))
+    except Exception as e:
+        logging.error(f"Error checking if files exist: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # a list of objects with role and content as strings
 class HistoryMessage(BaseModel):
     role: str
@@ -212,22 +326,135 @@ class SearchRequest(BaseModel):
     token_limit: int
     temperature: float
     verbose: bool
+    # False skips the cached results, e.g. to retry a query, the new result still replaces the cached one
+    use_cache: bool = True
 
 # This middleware will create a new queue for each request and attach it to the request state
 # This way, logc calls will log to this queue allowing the response to stream the steps to client before the final result
 from utils.logc import log_hook_var
 
+# Pure ASGI middleware (not BaseHTTPMiddleware) to avoid wrapping every request and response in extra tasks and streams
+class LogQueueMiddleware:
+    def __init__(self, app, path_prefix: str = "/search-stream"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        log_queue = asyncio.Queue()
+        scope.setdefault("state", {})["log_queue"] = log_queue
+        # asyncio.Queue is not thread safe, logc is called from the search worker thread so puts are scheduled on the loop
+        loop = asyncio.get_running_loop()
+        log_hook = lambda message, text=None: loop.call_soon_threadsafe(log_queue.put_nowait, ["STEP", [message, text]])
+        # The log hook is reset only once the response has been fully streamed
+        token = log_hook_var.set(log_hook)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            log_hook_var.reset(token)
+
+app.add_middleware(LogQueueMiddleware)
+
 # Generator function to stream the steps to the client
 # The generator will yield each step as it is logged and then the final result at the end
 # Expected steps are tuples of (kind, content) where kind is either "STEP" or "RESULT", or "END" to signal the end of the stream
+# Steps already waiting in the queue when the generator wakes up are sent together in a single chunk
 async def result_streamer(request_steps_queue: asyncio.Queue):
     while True:
-        step = await request_steps_queue.get()
-        print(f"\n\nStep: {step}\n\n")
-        kind, content = step
-        if kind == "END":
-            break
-        yield json.dumps(step) + "\n" # NEW LINE DELIMITED JSON
+        steps = [await request_steps_queue.get()]
+        while not request_steps_queue.empty():
+            steps.append(request_steps_queue.get_nowait())
+
+        chunk = bytearray()
+        for step in steps:
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("Step: %s", step)
+            if step[0] == "END":
+                if chunk:
+                    yield bytes(chunk)
+                return
+            # Encoded to bytes directly, non string keys are converted as json.dumps does
+            chunk += orjson.dumps(step, option=orjson.OPT_NON_STR_KEYS) + b"\n" # NEW LINE DELIMITED JSON
+        yield bytes(chunk)
+
+# Version of the index content, the etag of the index document changes with every upload, ingestion update and job status
+# Read through the Cosmos cache, so a change is seen by every worker within COSMOS_CACHE_TTL
+async def get_index_version(index_name):
+    document = await cached_cosmos_read(("log", index_name), cosmos_log.read_document, index_name, index_name)
+    return document.get("_etag") if document is not None else None
+
+def get_search_cache_params(input: SearchRequest, index_version):
+    # verbose only changes the logging and use_cache only the lookup, every other parameter can change the result
+    params = input.model_dump(exclude={"verbose", "use_cache"})
+    params["index_version"] = index_version
+    return params
+
+# "No final answer." is what search returns when the model output has no final_answer
+def is_cacheable_answer(final_answer):
+    return isinstance(final_answer, str) and final_answer.strip() != "" and final_answer != "No final answer."
+
+# Runs the search unless a cached result matches, returns [final_answer, references, output_excel, search_results, files]
+# For a new result it also returns a function that adds the query to the semantic tier of the cache,
+# it may call the embedding API so the caller runs it once the result has been sent
+def run_search_cached(input: SearchRequest, index_version):
+    cache_params = get_search_cache_params(input, index_version)
+    query_embedding = None
+    if input.use_cache:
+        result, query_embedding = search_cache.get_similar(cache_params)
+        if result is not None:
+            return result, None
+
+    final_answer, references, output_excel, search_results, files = search(
+        query=input.query, 
+        learnings=None, 
+        top=input.top, 
+        approx_tag_limit=input.approx_tag_limit, 
+        conversation_history=input.conversation_history, 
+        user_id=input.user_id, 
+        computation_approach=input.computation_approach, 
+        computation_decision=input.computation_decision, 
+        vision_support=input.vision_support, 
+        include_master_py=input.include_master_py, 
+        vector_directory=os.path.join(ROOT_PATH_INGESTION, input.index_name), 
+        vector_type=input.vector_type, 
+        index_name=input.index_name, 
+        full_search_output=input.full_search_output, 
+        count=input.count, 
+        token_limit=input.token_limit, 
+        temperature=input.temperature, 
+        verbose=input.verbose)
+
+    result = [final_answer, references, output_excel, search_results, files]
+    # search returns normally when the answer could not be parsed, such results are not replayed to a retrying user
+    if not is_cacheable_answer(final_answer):
+        return result, None
+    search_cache.put(cache_params, result)
+    return result, lambda: search_cache.add_query_embedding(cache_params, query_embedding)
+
+# Search must be run in a separate thread to allow the steps to be streamed to the client
+# The queue belongs to the event loop, every put from the worker thread goes through loop.call_soon_threadsafe
+def run_search_in_thread(input: SearchRequest, index_version, request_steps_queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+    add_query_embedding = None
+    try:
+        result, add_query_embedding = run_search_cached(input, index_version)
+        
+        # First put result in the queue, then signal the end of the stream
+        loop.call_soon_threadsafe(request_steps_queue.put_nowait, ("RESULT", result))
+    except Exception as e:
+        # The error is reported to the client through the stream as (kind, content), there is no caller to raise to in the worker thread
+        logging.error(f"Error running search: {str(e)}", exc_info=True)
+        loop.call_soon_threadsafe(request_steps_queue.put_nowait, ("ERROR", str(e)))
+    finally:
+        # Signal the end of the stream
+        # This must be done in a finally block to ensure the stream is closed even if an exception occurs
+        loop.call_soon_threadsafe(request_steps_queue.put_nowait, ("END", None))
+
+    # After the end of the stream, so the embedding call does not delay the client
+    if add_query_embedding is not None:
+        add_query_embedding()
 
 # SEARCH endpoint that streams the steps to the client
 @app.post("/search-stream")
@@ -236,53 +463,33 @@ async def run_search_stream(request: Request):
         # Parse request body as SearchRequest
         payload = SearchRequest(**await request.json())
         # invoke search function matching the signature using the request object
-        logging.info(f"Running search with input: {payload}")
+        logging.debug("Running search with input: %s", payload)
         # Provided by the middleware above
-        steps_queue = asyncio.Queue()
-        # Search must be run in a separate thread to allow the steps to be streamed to the client
-        def run_search_in_thread(input: SearchRequest, request_steps_queue: asyncio.Queue):
-            log_hook = lambda message, text=None: request_steps_queue.put_nowait(["STEP", [message, text]])
-            token = log_hook_var.set(log_hook)
-            try:
-                final_answer, references, output_excel, search_results, files = search(
-                    query=input.query, 
-                    learnings=None, 
-                    top=input.top, 
-                    approx_tag_limit=input.approx_tag_limit, 
-                    conversation_history=input.conversation_history, 
-                    user_id=input.user_id, 
-                    computation_approach=input.computation_approach, 
-                    computation_decision=input.computation_decision, 
-                    vision_support=input.vision_support, 
-                    include_master_py=input.include_master_py, 
-                    vector_directory=os.path.join(ROOT_PATH_INGESTION, input.index_name), 
-                    vector_type=input.vector_type, 
-                    index_name=input.index_name, 
-                    full_search_output=input.full_search_output, 
-                    count=input.count, 
-                    token_limit=input.token_limit, 
-                    temperature=input.temperature, 
-                    verbose=input.verbose)
-                
-                # First put result in the queue, then signal the end of the stream
-                request_steps_queue.put_nowait(("RESULT", [final_answer, references, output_excel, search_results, files]))
-            except Exception as e:
-                logging.error(f"Error running search: {str(e)}", exc_info=True)
-                request_steps_queue.put_nowait(("ERROR", str(e), None))
-                raise HTTPException(status_code=500, detail=str(e))
-            finally:
-                # Signal the end of the stream
-                # This must be done in a finally block to ensure the stream is closed even if an exception occurs
-                request_steps_queue.put_nowait(("END", None)) 
-                log_hook_var.reset(token)
-
-         # Create a new thread to run the search function
-        search_thread = threading.Thread(target=run_search_in_thread, args=(payload, steps_queue))
-        search_thread.start()
+        steps_queue = request.scope["state"]["log_queue"]
+
+        # An exact cache hit is answered right away without using a search slot
+        index_version = await get_index_version(payload.index_name)
+        cached_result = search_cache.get(get_search_cache_params(payload, index_version)) if payload.use_cache else None
+        if cached_result is not None:
+            steps_queue.put_nowait(("RESULT", cached_result))
+            steps_queue.put_nowait(("END", None))
+            return StreamingResponse(result_streamer(steps_queue), media_type="application/x-ndjson")
+
+        # Wait for a search slot, it is released when the search finishes in the worker pool
+        await SEARCH_SEMAPHORE.acquire()
+        try:
+            # The search runs in a copy of the current context so the log hook set by the middleware applies to it
+            search_context = contextvars.copy_context()
+            loop = asyncio.get_running_loop()
+            search_future = loop.run_in_executor(SEARCH_POOL, search_context.run, run_search_in_thread, payload, index_version, steps_queue, loop)
+        except Exception:
+            SEARCH_SEMAPHORE.release()
+            raise
+        search_future.add_done_callback(lambda _: SEARCH_SEMAPHORE.release())
 
         # Return the streaming response
         # NOTE: this must be returned immediately to allow the client to start receiving the stream
-        # This is why a separate thread is used to run the search function, headers={"Transfer-Encoding": "identity"}
+        # This is why the search function is run in the worker pool, headers={"Transfer-Encoding": "identity"}
         return StreamingResponse(result_streamer(steps_queue), media_type="application/x-ndjson")
     except Exception as e:
         logging.error(f"Error running search: {str(e)}", exc_info=True)
@@ -296,29 +503,14 @@ def modify_log_ui_func_hook(request: Request):
     return steps
 # A POST /search that takes a JSON with following structure:
 @app.post("/search", description="OBSOLETE, use /search-stream instead")
-def run_search(request: SearchRequest, steps = Depends(modify_log_ui_func_hook)):
+async def run_search(request: SearchRequest, background_tasks: BackgroundTasks, steps = Depends(modify_log_ui_func_hook)):
     try:
         # invoke search function matching the signature using the request object
         logging.info(f"Running search with input: {request}")
-        final_answer, references, output_excel, search_results, files = search(
-            query=request.query, 
-            learnings=None, 
-            top=request.top, 
-            approx_tag_limit=request.approx_tag_limit, 
-            conversation_history=request.conversation_history, 
-            user_id=request.user_id, 
-            computation_approach=request.computation_approach, 
-            computation_decision=request.computation_decision, 
-            vision_support=request.vision_support, 
-            include_master_py=request.include_master_py, 
-            vector_directory=os.path.join(ROOT_PATH_INGESTION, request.index_name), 
-            vector_type=request.vector_type, 
-            index_name=request.index_name, 
-            full_search_output=request.full_search_output, 
-            count=request.count, 
-            token_limit=request.token_limit, 
-            temperature=request.temperature, 
-            verbose=request.verbose)
+        index_version = await get_index_version(request.index_name)
+        (final_answer, references, output_excel, search_results, files), add_query_embedding = await asyncio.to_thread(run_search_cached, request, index_version)
+        if add_query_embedding is not None:
+            background_tasks.add_task(add_query_embedding)
         return final_answer, references, output_excel, search_results, files, steps
     except Exception as e:
         logging.error(f"Error running search: {str(e)}", exc_info=True)
@@ -329,42 +521,90 @@ def run_search(request: SearchRequest, steps = Depends(modify_log_ui_func_hook))
 async def generate_new_section(section: Request):
     try:
         logging.info("Generating section")
-        return generate_section(await section.json())
+        return await asyncio.to_thread(generate_section, await section.json())
     except Exception as e:
         logging.error(f"Error generating section: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# The directories are created once per index and process, later calls only return the cached paths
+# so the routes call it directly instead of going through a worker thread
+@functools.lru_cache(maxsize=256)
 def ensure_download_dictory(index_name):
     """Ensure download directory exists and return the path to it"""
     
-    logging.info(f"Current working directory: {os.getcwd()}")
-    logging.info(f"Root path ingestion: {ROOT_PATH_INGESTION}")
     ingestion_directory = os.path.join(ROOT_PATH_INGESTION , index_name)
     download_directory = os.path.join(ingestion_directory, 'downloads')
-        # log cwd, ingestion directory and download directory
-    logging.info(f"Ingestion directory: {ingestion_directory}")
-    logging.info(f"Download directory: {download_directory}")
+    # log cwd, ingestion directory and download directory
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug("Current working directory: %s", os.getcwd())
+        logging.debug("Ingestion directory: %s", ingestion_directory)
+        logging.debug("Download directory: %s", download_directory)
     os.makedirs(download_directory, exist_ok=True)
     return ingestion_directory, download_directory
 
+def list_download_files(download_directory):
+    """Return the names of the regular files in the download directory"""
+    files = os.listdir(download_directory)
+    return [file for file in files if os.path.isfile(os.path.join(download_directory, file))]
+
+UPLOAD_CHUNK_SIZE = 1 << 20 # 1 MiB
+
+# Uploads for the same index arriving within the debounce window share one Cosmos update of the index document
+# Every upload waits for that update, so errors reach the client and no update is left pending at shutdown
+pending_index_updates = {} # index_name -> asyncio.Future resolved by the next flush
+index_update_locks = {} # index_name -> asyncio.Lock
+index_update_tasks = set() # keeps a reference to running flushes so they are not garbage collected
+
+async def update_index_files(index_name, download_directory):
+    """Wait for the Cosmos update of the index document with the files in the download directory"""
+    update = pending_index_updates.get(index_name)
+    if update is None:
+        loop = asyncio.get_running_loop()
+        update = loop.create_future()
+        pending_index_updates[index_name] = update
+        def start_flush():
+            task = asyncio.ensure_future(flush_index_update(index_name, download_directory))
+            index_update_tasks.add(task)
+            task.add_done_callback(index_update_tasks.discard)
+        loop.call_later(INDEX_UPDATE_DEBOUNCE, start_flush)
+    # Shielded so a cancelled upload does not cancel the update for the other waiters
+    await asyncio.shield(update)
+
+async def flush_index_update(index_name, download_directory):
+    lock = index_update_locks.setdefault(index_name, asyncio.Lock())
+    async with lock:
+        # Uploads joining while the lock is awaited are still covered, the directory is listed after this point
+        update = pending_index_updates.pop(index_name)
+        try:
+            await asyncio.to_thread(ic.update_cosmos_with_download_files, index_name, download_directory)
+            update.set_result(None)
+        except Exception as e:
+            update.set_exception(e)
+        finally:
+            invalidate_index_cache(index_name)
+
+async def save_upload_file(file: UploadFile, file_path):
+    """Stream the uploaded file to file_path in chunks without blocking the event loop"""
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await buffer.write(chunk)
+
 # A GET operation to get the list of existing files in downaload directory
 @app.get("/index/{index_name}/files")
-def get_download_files(index_name: str):
+async def get_download_files(index_name: str):
     try:
-        logging.info("Getting download files")
+        logging.debug("Getting download files")
         
         ingestion_directory, download_directory = ensure_download_dictory(index_name)
         
-        files = os.listdir(download_directory)
-        existing_file_names = [file for file in files if os.path.isfile(os.path.join(download_directory, file))]
-        return existing_file_names
+        return await asyncio.to_thread(list_download_files, download_directory)
     except Exception as e:
         logging.error(f"Error getting download files: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 # A POST operation to upload files in batches in download directory
 @app.post("/index/{index_name}/files")
-def upload_files(index_name: str, files: List[UploadFile]):
+async def upload_files(index_name: str, files: List[UploadFile]):
     try:
         logging.info("Uploading files")
         
@@ -372,10 +612,9 @@ def upload_files(index_name: str, files: List[UploadFile]):
         
         for file in files:
             file_path = os.path.join(download_directory, file.filename.replace(" ", "_"))
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await save_upload_file(file, file_path)
             
-        ic.update_cosmos_with_download_files(index_name, download_directory)
+        await update_index_files(index_name, download_directory)
             
         return None
     except Exception as e:
@@ -411,24 +650,45 @@ class IngestionRequest(BaseModel):
 #         raise HTTPException(status_code=500, detail=str(e))
 
 cogsearch = CogSearchHttpRequest()
+
+# One CogSearchRestAPI per index, and the index definition is cached since it rarely changes
+# A missing index is cached for a shorter time so it is picked up soon after an ingestion creates it
+cog_search_index_cache = TTLCache(maxsize=128, ttl=COG_SEARCH_INDEX_CACHE_TTL)
+cog_search_missing_index_cache = TTLCache(maxsize=128, ttl=COG_SEARCH_MISSING_INDEX_CACHE_TTL)
+
+@functools.lru_cache(maxsize=128)
+def get_cog_search_api(index_name):
+    return CogSearchRestAPI(index_name)
+
+async def get_cog_search_index(index_name):
+    if index_name in cog_search_index_cache:
+        return cog_search_index_cache[index_name]
+    if index_name in cog_search_missing_index_cache:
+        return None
+
+    index = await asyncio.to_thread(get_cog_search_api(index_name).get_index)
+    if index is None:
+        cog_search_missing_index_cache[index_name] = True
+    else:
+        cog_search_index_cache[index_name] = index
+    return index
 # A GET to return the list of cog_search indexes
 @app.get("/index")
-def get_indexes():
+async def get_indexes():
     try:
-        logging.info("Getting indexes")
-        return cogsearch.get_indexes()
+        logging.debug("Getting indexes")
+        return await asyncio.to_thread(cogsearch.get_indexes)
     except Exception as e:
         logging.error(f"Error getting indexes: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 # A GET to get CogSearch index documents, is exists
 @app.get("/index/{index_name}/documents")
-def get_index_status(index_name: str):
+async def get_index_status(index_name: str):
     try:
-        logging.info("Getting index status")
-        index = CogSearchRestAPI(index_name)
-        if index.get_index() is not None:
-            documents = index.get_documents()
+        logging.debug("Getting index status")
+        if await get_cog_search_index(index_name) is not None:
+            documents = await asyncio.to_thread(get_cog_search_api(index_name).get_documents)
             return documents
         return None
     except Exception as e:
@@ -437,30 +697,36 @@ def get_index_status(index_name: str):
 
 # A GET operation to check indexing status
 @app.get("/index/{index_name}/status")
-def get_indexing_status(index_name: str):
+async def get_indexing_status(index_name: str):
     try:
-        logging.info("Checking indexing status")
-        return ic.check_if_indexing_in_progress(index_name)
+        logging.debug("Checking indexing status")
+        return await cached_cosmos_read(("status", index_name), ic.check_if_indexing_in_progress, index_name)
     except Exception as e:
         logging.error(f"Error checking indexing status: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 # A POST operation to update AmlJob status
 @app.post("/index/{index_name}/status")
-def update_job_status(index_name: str, request: Request):
+async def update_job_status(index_name: str, request: Request):
     try:
         logging.info("Updating Job status")
-        return ic.update_aml_job_status(index_name, request.get("status"))
+        status = (await request.json()).get("status")
+        result = await asyncio.to_thread(ic.update_aml_job_status, index_name, status)
+        invalidate_index_cache(index_name)
+        # The job has finished or stopped, cached search results may not reflect the newly ingested documents
+        search_cache.invalidate_index(index_name)
+        return result
     except Exception as e:
         logging.error(f"Error updating Job status: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 # A DELETE operation to clear indexing status
 @app.delete("/index/{index_name}/status")
-def clear_indexing_status(index_name: str):
+async def clear_indexing_status(index_name: str):
     try:
         logging.info("Clearing indexing status")
-        ic.clear_indexing_in_progress(index_name)
+        await asyncio.to_thread(ic.clear_indexing_in_progress, index_name)
+        invalidate_index_cache(index_name)
         return None
     except Exception as e:
         logging.error(f"Error clearing indexing status: {str(e)}", exc_info=True)
@@ -480,7 +746,7 @@ class JobRequest(BaseModel):
 
 # A POST operation to submit an AmlJob
 @app.post("/index/{index_name}/aml_job")
-def submit_aml_job(index_name: str, request: JobRequest):
+async def submit_aml_job(index_name: str, request: JobRequest):
     try:
         logging.info(f"Submitting AmlJob from request: {request}")
         ingestion_directory, download_directory = ensure_download_dictory(index_name)
@@ -495,20 +761,30 @@ def submit_aml_job(index_name: str, request: JobRequest):
         # log dict
         logging.info(f"AML job parameters: {dict}")
         
-        run_id = aml_job.submit_ingestion_job(dict, script = 'ingest_doc.py', source_directory='./code')
+        run_id = await asyncio.to_thread(aml_job.submit_ingestion_job, dict, script = 'ingest_doc.py', source_directory='./code')
         
         # log run_id
         logging.info(f"Aml job run_id: {run_id}")
         
-        ic.update_aml_job_id(index_name, run_id, status = "running")
+        await asyncio.to_thread(ic.update_aml_job_id, index_name, run_id, status = "running")
+        invalidate_index_cache(index_name)
         return None
     except Exception as e:
         logging.error(f"Error submitting AmlJob: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
     
+def start_local_ingestion_job(ingestion_params_dict: dict):
+    """Start ingest_doc.py as a subprocess, passing the params as JSON on stdin to avoid the argv size limit"""
+    process = subprocess.Popen(["python", "./ingest_doc.py", 
+                    "--ingestion_params_stdin",
+                    ], stdin=subprocess.PIPE)
+    process.stdin.write(orjson.dumps(ingestion_params_dict))
+    process.stdin.close()
+    return process
+
 # POST operation to submit a local ingestion job
 @app.post("/index/{index_name}/local_job")
-def submit_local_job(index_name: str, request: JobRequest):
+async def submit_local_job(index_name: str, request: JobRequest):
     ingestion_directory, download_directory = ensure_download_dictory(index_name)
     
     dict = request.model_dump()
@@ -518,34 +794,37 @@ def submit_local_job(index_name: str, request: JobRequest):
     # log dict
     logging.info(f"Local job request: {dict}")
     
-    process = subprocess.Popen(["python", "./ingest_doc.py", 
-                    "--ingestion_params_dict", json.dumps(dict),
-                    ])
+    process = await asyncio.to_thread(start_local_ingestion_job, dict)
     
     # log process PID
     logging.info(f"Local job PID: {process.pid}")
     
     return process.pid
 
+# Created on first use and shared across requests, DefaultAzureCredential probes several credential sources
+# when created, and reusing the client keeps its HTTP connections alive
+@functools.lru_cache(maxsize=1)
+def get_container_apps_client():
+    return ContainerAppsAPIClient(credential=DefaultAzureCredential(), subscription_id=AML_SUBSCRIPTION_ID)
+
+def get_container_apps_job_status(job_name: str, job_id: str):
+    """Get the status of a container apps job execution, blocking until the SDK call returns"""
+    client = get_container_apps_client()
+    job = client.job_execution(AML_RESOURCE_GROUP, job_name, job_id)
+    return job.additional_properties['properties']['status']
+
 @app.get("/job/{job_id}")
-def get_job_status(job_id: str):    
-    from azure.mgmt.appcontainers import ContainerAppsAPIClient
-    from azure.identity import DefaultAzureCredential
-    from env_vars import AML_RESOURCE_GROUP, AML_SUBSCRIPTION_ID
-    
+async def get_job_status(job_id: str):
     try:
-        logging.info(f"Getting Job status with ID {job_id}")
-        job_name = os.getenv("INGESTION_JOB_NAME")
+        logging.debug("Getting Job status with ID %s", job_id)
         job_status = None
         
-        if job_name in job_id:
-            client = ContainerAppsAPIClient(credential=DefaultAzureCredential(), subscription_id=AML_SUBSCRIPTION_ID)
-            job = client.job_execution(AML_RESOURCE_GROUP, job_name, job_id)
-            job_status = job.additional_properties['properties']['status'] 
+        if INGESTION_JOB_NAME and INGESTION_JOB_NAME in job_id:
+            job_status = await asyncio.to_thread(get_container_apps_job_status, INGESTION_JOB_NAME, job_id)
         else:
-            job_status = aml_job.check_job_status_using_run_id(job_id)
+            job_status = await asyncio.to_thread(aml_job.check_job_status_using_run_id, job_id)
             
-        logging.info(f"Job '{job_id}' status: {job_status}")
+        logging.debug("Job '%s' status: %s", job_id, job_status)
         return job_status
     except Exception as e:
         logging.error(f"Error getting Job status ID: {str(e)}", exc_info=True)
@@ -554,7 +833,7 @@ def get_job_status(job_id: str):
 @app.get("/local_job/{pid}")
 def get_local_job_status(pid: str):
     try:
-        logging.info(f"Getting local job status from PID {pid}")
+        logging.debug("Getting local job status from PID %s", pid)
         
         # Detect is process is running
         if psutil.pid_exists(int(pid)):
@@ -567,10 +846,10 @@ def get_local_job_status(pid: str):
 
 # A GET to fetch processin plan
 @app.get("/processing_plan")
-def get_processing_plan():
+async def get_processing_plan():
     try:
-        logging.info("Getting processing plan")
-        proc_plans = read_asset_file("./processing_plan.json")[0]
+        logging.debug("Getting processing plan")
+        proc_plans = await asyncio.to_thread(read_asset_file_cached, "./processing_plan.json")
 
         return proc_plans
     except Exception as e:
@@ -579,14 +858,14 @@ def get_processing_plan():
 
 # A POST to copy the processing plan to the index
 @app.post("/index/{index_name}/plan")
-def copy_processing_plan_to_index(index_name: str):
+async def copy_processing_plan_to_index(index_name: str):
     try:
         logging.info("Copying processing plan to index")
         ingestion_directory = os.path.join(ROOT_PATH_INGESTION , index_name) 
         index_processing_plan_path = os.path.join(ingestion_directory, f'{index_name}.processing_plan.txt')
-        plans = get_processing_plan()
-        os.makedirs(ingestion_directory, exist_ok=True)
-        write_to_file(plans, index_processing_plan_path, 'w')
+        plans = await get_processing_plan()
+        await asyncio.to_thread(os.makedirs, ingestion_directory, exist_ok=True)
+        await asyncio.to_thread(write_to_file, plans, index_processing_plan_path, 'w')
         return None
     except Exception as e:
         logging.error(f"Error copying processing plan to index: {str(e)}", exc_info=True)
@@ -594,24 +873,34 @@ def copy_processing_plan_to_index(index_name: str):
 
 # A GET to fetch cosmos log
 @app.get("/index/{index_name}/log")
-def get_cosmos_log(index_name: str):
+async def get_cosmos_log(index_name: str):
     try:
-        logging.info("Getting cosmos log")
-        return cosmos_log.read_document(index_name, index_name)
+        logging.debug("Getting cosmos log")
+        return await cached_cosmos_read(("log", index_name), cosmos_log.read_document, index_name, index_name)
     except Exception as e:
         logging.error(f"Error getting cosmos log: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def start_container_apps_job(ingestion_params_dict: dict):
+    """Start a container apps job execution and return its name, blocking until the SDK poller completes"""
+    client = get_container_apps_client()
+    
+    job = client.jobs.get(AML_RESOURCE_GROUP, INGESTION_JOB_NAME)
+    job.template.containers[0].args = ["ingest_doc.py", "--ingestion_params_dict", json.dumps(ingestion_params_dict)]
+    template = JobExecutionTemplate(containers=job.template.containers)
+    poller: LROPoller[JobExecutionBase] = client.jobs.begin_start(
+        resource_group_name=AML_RESOURCE_GROUP, 
+        job_name= INGESTION_JOB_NAME,
+        template=template)
+    
+    res: JobExecutionBase = poller.result()
+    logging.info(f"Submit job result: {res}")
+    return res.name
+
 # A POST method to execute a container apps job
 @app.post("/index/{index_name}/container_apps_job")
-def container_apps_job(index_name: str, request: JobRequest):
-    from azure.mgmt.appcontainers import ContainerAppsAPIClient
-    from azure.mgmt.appcontainers.models import JobExecutionBase, JobExecutionTemplate
-    from azure.core.polling import LROPoller
-    from azure.identity import DefaultAzureCredential
-    from env_vars import AML_RESOURCE_GROUP, AML_SUBSCRIPTION_ID
-    
+async def container_apps_job(index_name: str, request: JobRequest):
     try:
         logging.info("Executing container apps job")
         
@@ -625,21 +914,10 @@ def container_apps_job(index_name: str, request: JobRequest):
         dict['vision_models'] = gpt4_models
         dict['models'] = gpt4_models
         
-        client = ContainerAppsAPIClient(credential=DefaultAzureCredential(), subscription_id=AML_SUBSCRIPTION_ID)
-        
-        job = client.jobs.get(AML_RESOURCE_GROUP, os.getenv("INGESTION_JOB_NAME"))
-        job.template.containers[0].args = ["ingest_doc.py", "--ingestion_params_dict", json.dumps(dict)]
-        template = JobExecutionTemplate(containers=job.template.containers)
-        poller: LROPoller[JobExecutionBase] = client.jobs.begin_start(
-            resource_group_name=AML_RESOURCE_GROUP, 
-            job_name= os.getenv("INGESTION_JOB_NAME"),
-            template=template)
-        
-        res: JobExecutionBase = poller.result()
-        logging.info(f"Submit job result: {res}")
-        run_id = res.name
+        run_id = await asyncio.to_thread(start_container_apps_job, dict)
         
-        ic.update_aml_job_id(index_name, run_id, status = "running")
+        await asyncio.to_thread(ic.update_aml_job_id, index_name, run_id, status = "running")
+        invalidate_index_cache(index_name)
         
         return run_id
     except Exception as e:   
@@ -0,0 +1,7 @@
+# Gunicorn worker for the API
+from uvicorn_worker import UvicornWorker
+
+class ApiUvicornWorker(UvicornWorker):
+    # uvloop and httptools are installed with uvicorn[standard]
+    # The access log is disabled as it adds a logger call to every request, errors are still logged
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "access_log": False}
@@ -90,6 +90,23 @@ AML_SUBSCRIPTION_ID=os.environ.get('AML_SUBSCRIPTION_ID', '')
 AML_RESOURCE_GROUP=os.environ.get('AML_RESOURCE_GROUP', '')
 AML_WORKSPACE_NAME=os.environ.get('AML_WORKSPACE_NAME', '')
 
+## API
+PROMPTS_PATH = os.environ.get('PROMPTS_PATH', '')
+INGESTION_JOB_NAME = os.environ.get('INGESTION_JOB_NAME', '')
+LOCAL_TESTING = os.environ.get('LOCAL_TESTING', '')
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', '8'))
+SEARCH_MAX_CONCURRENCY = int(os.environ.get('SEARCH_MAX_CONCURRENCY', '16'))
+COSMOS_CACHE_TTL = float(os.environ.get('COSMOS_CACHE_TTL', '2.0'))
+INDEX_UPDATE_DEBOUNCE = float(os.environ.get('INDEX_UPDATE_DEBOUNCE', '0.5'))
+COG_SEARCH_INDEX_CACHE_TTL = float(os.environ.get('COG_SEARCH_INDEX_CACHE_TTL', '30'))
+COG_SEARCH_MISSING_INDEX_CACHE_TTL = float(os.environ.get('COG_SEARCH_MISSING_INDEX_CACHE_TTL', '5'))
+FILE_EXISTS_CACHE_TTL = float(os.environ.get('FILE_EXISTS_CACHE_TTL', '2.0'))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '1024'))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_SIMILARITY = float(os.environ.get('SEARCH_CACHE_SIMILARITY', '0.95'))
+SEARCH_SEMANTIC_CACHE = os.environ.get('SEARCH_SEMANTIC_CACHE', 'false').lower() == 'true'
+SEARCH_CACHE_EMBEDDING_TIMEOUT = float(os.environ.get('SEARCH_CACHE_EMBEDDING_TIMEOUT', '5'))
+
 ## Azure File Share
 AZURE_FILE_SHARE_ACCOUNT=os.environ.get('AZURE_FILE_SHARE_ACCOUNT', '')
 AZURE_FILE_SHARE_NAME=os.environ.get('AZURE_FILE_SHARE_NAME', '')
@@ -8,5 +8,6 @@ log_file = "-"
 
 bind = "0.0.0.0:80"
 
-worker_class = "uvicorn.workers.UvicornWorker"
+# uvloop event loop, httptools parser and no per request access log, see api_worker.py
+worker_class = "api_worker.ApiUvicornWorker"
 workers = (multiprocessing.cpu_count() * 2) + 1
\ No newline at end of file
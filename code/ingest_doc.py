@@ -22,6 +22,7 @@ parser = argparse.ArgumentParser(description='Ingest documents.')
 
 # Add the required arguments
 parser.add_argument('--ingestion_params_dict', type=str, help='Ingestion params dictionary')
+parser.add_argument('--ingestion_params_stdin', action='store_true', help='Read the ingestion params dictionary as JSON from stdin')
 
 setup_logger()
 
@@ -29,7 +30,10 @@ setup_logger()
 args = parser.parse_args()
 
 # Access the arguments
-ingestion_params_dict = json.loads(args.ingestion_params_dict)
+if args.ingestion_params_stdin:
+    ingestion_params_dict = json.loads(sys.stdin.buffer.read())
+else:
+    ingestion_params_dict = json.loads(args.ingestion_params_dict)
 
 ## AML Job
 datastore_mount = ingestion_params_dict.get('datastore_mount', None)
@@ -0,0 +1,137 @@
+import logging
+import threading
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
+from env_vars import SEARCH_CACHE_EMBEDDING_TIMEOUT
+from utils.openai_utils import oai_emb_client, AZURE_OPENAI_EMBEDDING_MODEL
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+class SearchResultCache():
+    """
+    Cache of search results with two tiers:
+        - exact: all the search parameters and the normalized query must match
+        - semantic: all the search parameters but the query must match, and the query embedding must be
+          at least similarity_threshold (cosine) close to the embedding of a cached query
+    The semantic tier is off by default: queries that differ only by a year or a name are usually above
+    the threshold and would get the answer of the other query.
+    The cache is shared by the search worker threads, so every access is done under a lock.
+    """
+
+    def __init__(self, maxsize = 1024, ttl = 300, similarity_threshold = 0.95, semantic = False):
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)   # exact key -> (index_name, result)
+        self.embeddings = {}                                # exact key -> (params key, normalized embedding), pruned on put
+        self.similarity_threshold = similarity_threshold
+        self.semantic = semantic
+        self.lock = threading.Lock()
+
+
+    def get_keys(self, params):
+        params = dict(params)
+        query = normalize_query(params.pop("query"))
+        params_key = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        return params_key, (params_key, query)
+
+
+    def get(self, params):
+        """Exact tier only, does not call any external service"""
+        _, key = self.get_keys(params)
+        with self.lock:
+            cached = self.results.get(key)
+        return cached[1] if cached is not None else None
+
+
+    def get_similar(self, params):
+        """
+        Exact tier first, then semantic tier.
+        Returns the cached result or None, and the query embedding if one was computed for the lookup.
+        """
+        result = self.get(params)
+        if result is not None or not self.semantic:
+            return result, None
+
+        # Only embed the query if a cached result could match, the parameters other than the query must be equal
+        params_key, _ = self.get_keys(params)
+        if not self.has_candidates(params_key):
+            return None, None
+
+        embedding = self.get_query_embedding(params["query"])
+        if embedding is None:
+            return None, None
+
+        # The timer is frozen so that no entry expires between the candidate selection and the read
+        with self.lock, self.results.timer:
+            candidates = [(key, e) for key, (k, e) in self.embeddings.items() if k == params_key and key in self.results]
+            if len(candidates) == 0:
+                return None, embedding
+
+            similarities = np.stack([e for _, e in candidates]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None, embedding
+
+            logging.info(f"Search cache semantic hit with similarity {similarities[best]:.3f}")
+            return self.results[candidates[best][0]][1], embedding
+
+
+    def has_candidates(self, params_key):
+        with self.lock, self.results.timer:
+            return any(k == params_key and key in self.results for key, (k, _) in self.embeddings.items())
+
+
+    def put(self, params, result):
+        """Exact tier only, see add_query_embedding for the semantic tier"""
+        _, key = self.get_keys(params)
+        with self.lock:
+            self.results[key] = (params["index_name"], result)
+            # Drop the embeddings of the results that expired or were evicted
+            self.embeddings = {k: v for k, v in self.embeddings.items() if k in self.results}
+
+
+    def add_query_embedding(self, params, embedding = None):
+        """
+        Make a cached result available to the semantic tier.
+        This calls the embedding API when no embedding is given, so it should run once the result has been sent.
+        """
+        if not self.semantic:
+            return
+
+        params_key, key = self.get_keys(params)
+        with self.lock:
+            if key not in self.results or key in self.embeddings:
+                return
+
+        if embedding is None:
+            embedding = self.get_query_embedding(params["query"])
+            if embedding is None:
+                return
+
+        with self.lock:
+            if key in self.results:
+                self.embeddings[key] = (params_key, embedding)
+
+
+    def invalidate_index(self, index_name):
+        with self.lock, self.results.timer:
+            keys = [key for key, (name, _) in self.results.items() if name == index_name]
+            for key in keys:
+                self.results.pop(key, None)
+                self.embeddings.pop(key, None)
+
+
+    def get_query_embedding(self, query):
+        # No retries here, if the embedding cannot be computed the semantic tier is skipped and the search runs
+        try:
+            embedding = oai_emb_client.embeddings.create(input=[normalize_query(query)], model=AZURE_OPENAI_EMBEDDING_MODEL, timeout=SEARCH_CACHE_EMBEDDING_TIMEOUT).data[0].embedding
+        except Exception as e:
+            logging.warning(f"Search cache could not compute the query embedding: {e}")
+            return None
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else None
@@ -99,6 +99,15 @@ class APIClient:
             logging.error(f"Error checking file {asset_path}: {e}")
             raise
 
+    def check_files_exist(self, asset_paths):
+        try:
+            response = requests.post(f"{self.base_url}/files_exist", json={'paths': asset_paths})
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.HTTPError as e:
+            logging.error(f"Error checking files {asset_paths}: {e}")
+            raise
+
     def search(self, query_params):
         try:
             response = requests.post(f"{self.base_url}/search", json=query_params)
@@ -578,12 +587,13 @@ async def app_search(query: str):
                         cl.Text(name=f"Text below:", content=text, display="inline")]
             elif ref['type'] == 'table':
                 e = []
-                pngExists = api_client.check_file_exists(replace_extension(ref['asset'], '.png'))                
-                if pngExists:
-                    url = api_client.get_file_url(replace_extension(ref['asset'], '.png'), format="binary")
+                png_asset = replace_extension(ref['asset'], '.png')
+                filesExist = api_client.check_files_exist([png_asset, ref['asset']])
+                if filesExist[png_asset]:
+                    url = api_client.get_file_url(png_asset, format="binary")
                     e.append(cl.Image(name=os.path.basename(ref['asset']), url=url, size='large', display="inline"))
                     e.append(cl.Text(name=f"Text below:", content=text, display="inline"))
-                if api_client.check_file_exists(ref['asset']):
+                if filesExist[ref['asset']]:
                     e.append(cl.Text(name=f"Text below:", content=text, display="inline"))
             elif ref['type'] == 'file':
                 url = api_client.get_file_url(ref['asset'], format="binary")